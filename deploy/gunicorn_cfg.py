@@ -2,4 +2,8 @@ import multiprocessing
 
 bind = "unix:/run/tawhiri/v1.sock"
 pidfile = "/run/tawhiri/v1.pid"
-workers = 12
+# Predictions are solved in a per-worker process pool, so a few event-loop
+# workers are enough to keep every CPU busy.
+workers = 2
+worker_class = "uvicorn_worker.UvicornWorker"
+timeout = 120
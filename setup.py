@@ -51,12 +51,16 @@ setup(
     description='High Altitude Balloon Landing Prediction Software',
     long_description=long_description,
     test_suite='nose.collector',
-    tests_require=['nose', 'mock', 'Flask-Testing'],
+    tests_require=['nose', 'mock', 'httpx'],
     install_requires=[
-        "Flask",
-        "Flask-Script",
+        "fastapi",
+        "pydantic>=2",
+        "uvicorn[standard]",
+        "gunicorn",
+        "uvicorn-worker",
+        "orjson",
+        "requests",
         "strict-rfc3339",
-        "gunicorn"
     ],
     classifiers=[
         'Development Status :: 4 - Beta',
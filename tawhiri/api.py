@@ -19,26 +19,72 @@
 Provide the HTTP API for Tawhiri.
 """
 
-from flask import Flask, jsonify, request, g, send_file
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from pydantic import field_validator, model_validator
+from pydantic_core import PydanticCustomError
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Literal, Optional, Union
+import functools
+import hmac
+import multiprocessing
+import os
+import threading
 import time
 import strict_rfc3339
 import requests
+from requests.adapters import HTTPAdapter
 from loguru import logger
-from io import BytesIO
-import json
+import orjson
 
 from tawhiri import solver, models
 from tawhiri.dataset import Dataset as WindDataset
 from tawhiri.warnings import WarningCounts
-from tawhiri.csvformatter import format_csv, fix_data_longitudes
+from tawhiri.csvformatter import format_csv
 from tawhiri.kmlformatter import format_kml
 
-app = Flask(__name__)
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response serialised with orjson, which is considerably faster than
+    the standard library for large trajectories.
+    """
+    def render(self, content):
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY |
+                                           orjson.OPT_NON_STR_KEYS)
+
+
+@asynccontextmanager
+async def _lifespan(app):
+    yield
+    if _solver_pool is not None:
+        _solver_pool.shutdown()
+    await logger.complete()
+
+
+app = FastAPI(default_response_class=ORJSONResponse, lifespan=_lifespan)
+# Compression runs on the event loop for all but the largest bodies, and the
+# default level 9 costs ~10x the time of level 1 for a few percent smaller
+# trajectories.
+app.add_middleware(GZipMiddleware, minimum_size=1000, compresslevel=1)
+# Sinks are enqueued so that serialising and writing records happens in a
+# background thread rather than in the request handler. Several server
+# processes share these files, so they are rotated externally (see
+# deploy/logrotate.conf) rather than by loguru.
 logger.remove()
-logger.add("logs/tawhiri_debug.log", serialize=True, level="DEBUG")
-logger.add("logs/tawhiri_error.log", serialize=True, level="ERROR")
-logger.add("logs/tawhiri_warning.log", serialize=True, level="WARNING")
+logger.add("logs/tawhiri_debug.log", serialize=True, level="DEBUG",
+           enqueue=True, backtrace=False, diagnose=False)
+logger.add("logs/tawhiri_error.log", serialize=True, level="ERROR",
+           enqueue=True, backtrace=False, diagnose=False)
+logger.add("logs/tawhiri_warning.log", serialize=True, level="WARNING",
+           enqueue=True, backtrace=False, diagnose=False)
 
 API_VERSION = 1
 LATEST_DATASET_KEYWORD = "latest"
@@ -46,6 +92,55 @@ PROFILE_STANDARD = "standard_profile"
 PROFILE_FLOAT = "float_profile"
 PROFILE_REVERSE = "reverse_profile"
 STANDARD_FORMAT = "json"
+ELEVATION_API_TIMEOUT = 2.0
+DATASET_CACHE_TTL = 60.0
+
+# Configuration, read on every request; set with configure().
+#: Base URL of the (Ruaumoko) elevation API
+ELEVATION_API_URL = None
+#: Directory containing the wind datasets
+WIND_DATASET_DIR = WindDataset.DEFAULT_DIRECTORY
+#: Number of solver processes per server process; 0 solves in-process
+SOLVER_PROCESSES = os.cpu_count()
+#: Bearer token for the admin endpoints, which are disabled if None
+ADMIN_TOKEN = None
+
+
+def configure(settings):
+    """
+    Configure the API from a mapping of settings, any of ``ELEVATION_API``,
+    ``WIND_DATASET_DIR``, ``SOLVER_PROCESSES`` and ``ADMIN_TOKEN``.
+    """
+    global ELEVATION_API_URL, WIND_DATASET_DIR, SOLVER_PROCESSES, ADMIN_TOKEN
+    ELEVATION_API_URL = settings.get('ELEVATION_API', ELEVATION_API_URL)
+    WIND_DATASET_DIR = settings.get('WIND_DATASET_DIR', WIND_DATASET_DIR)
+    SOLVER_PROCESSES = int(settings.get('SOLVER_PROCESSES', SOLVER_PROCESSES))
+    ADMIN_TOKEN = settings.get('ADMIN_TOKEN', ADMIN_TOKEN)
+
+
+_SETTING_NAMES = ('ELEVATION_API', 'WIND_DATASET_DIR', 'SOLVER_PROCESSES',
+                  'ADMIN_TOKEN')
+
+
+def _settings_from_environ(environ):
+    """
+    The settings given as environment variables in `environ`.
+    """
+    return {name: environ[name] for name in _SETTING_NAMES if name in environ}
+
+# Settings may be given as environment variables, so that tawhiri.api:app can
+# be served directly.
+configure(_settings_from_environ(os.environ))
+
+# A single pooled session keeps connections to the elevation API alive
+# between requests, rather than paying for a new handshake per lookup.
+_elev_session = requests.Session()
+_elev_session.headers["Connection"] = "keep-alive"
+for _prefix in ("http://", "https://"):
+    _elev_session.mount(_prefix, HTTPAdapter(pool_connections=20,
+                                             pool_maxsize=100,
+                                             max_retries=0))
+del _prefix
 
 
 
@@ -55,15 +150,60 @@ STANDARD_FORMAT = "json"
 def _rfc3339_to_timestamp(dt):
     """
     Convert from a RFC3339 timestamp to a UNIX timestamp.
-    """
+
+    Timestamps of the usual form, with an optional ``.`` and up to six
+    fraction digits and a ``Z`` or ``±hh:mm`` offset, are parsed by
+    :meth:`datetime.fromisoformat`, which is much faster than
+    strict_rfc3339's regex. fromisoformat also accepts things RFC3339 does
+    not (comma fractions, offsets with seconds) and truncates long
+    fractions, so anything else falls back to strict_rfc3339, which either
+    parses it or raises :exc:`ValueError`.
+    """
+    if len(dt) >= 20 and dt[4] == '-' and dt[7] == '-' and dt[10] == 'T' \
+            and dt[13] == ':' and dt[16] == ':':
+        if dt[-1] == 'Z':
+            body, offset = dt[:-1], '+00:00'
+        elif len(dt) >= 25 and dt[-6] in '+-' and dt[-3] == ':':
+            body, offset = dt[:-6], dt[-6:]
+        else:
+            body = None
+        if body is not None and \
+                (len(body) == 19 or (body[19] == '.' and 21 <= len(body) <= 26)):
+            try:
+                return datetime.fromisoformat(body + offset).timestamp()
+            except ValueError:
+                pass
     return strict_rfc3339.rfc3339_to_timestamp(dt)
 
 
+@functools.lru_cache(maxsize=64)
+def _rfc3339_date(day):
+    """
+    The date part of a RFC3339 timestamp, `day` days after the UNIX epoch.
+    """
+    t = time.gmtime(day * 86400)
+    return f"{t.tm_year:04d}-{t.tm_mon:02d}-{t.tm_mday:02d}T"
+
+
 def _timestamp_to_rfc3339(dt):
     """
     Convert from a UNIX timestamp to a RFC3339 timestamp.
+
+    This is called for every trajectory point, so rather than using
+    strict_rfc3339 (which parses its own output back to check it) format the
+    fields directly. A trajectory rarely spans more than a day or two, so
+    the date part is cached and only the time of day is computed per point.
+    The output is identical: fractional seconds are rounded to the
+    microsecond and trailing zeros dropped.
     """
-    return strict_rfc3339.timestamp_to_rfc3339_utcoffset(dt)
+    seconds, microseconds = divmod(int(round(dt * 1e6)), 1000000)
+    day, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    datestring = f"{_rfc3339_date(day)}{hours:02d}:{minutes:02d}:{seconds:02d}"
+    if microseconds:
+        datestring += "." + f"{microseconds:06d}".rstrip("0")
+    return datestring + "Z"
 
 
 # Exceptions ##################################################################
@@ -105,6 +245,13 @@ class InternalException(APIException):
     status_code = 500
 
 
+class AuthorizationException(APIException):
+    """
+    Raised if an admin request does not carry the admin token.
+    """
+    status_code = 403
+
+
 class NotYetImplementedException(APIException):
     """
     Raised when the functionality has not yet been implemented.
@@ -125,87 +272,244 @@ def rate_clip(rate, minimum_rate=0.2):
 
 
 
-# Request #####################################################################
-def parse_request(data):
+# Elevation ###################################################################
+@functools.lru_cache(maxsize=4096)
+def _lookup_elevation(lat_q, lon_q):
     """
-    Parse the request.
+    Look up the ground elevation at (`lat_q`, `lon_q`) using Ruaumoko.
+
+    Callers round the coordinates to 3 decimal places (~100 m) so that
+    repeated launches from the same site share a cache entry. Failures raise
+    :exc:`ElevationAPIException` and are therefore never cached.
     """
-    req = {"version": API_VERSION}
+    elevation_response = _elev_session.get(
+        f"{ELEVATION_API_URL}/api/v1/lookup?locations={lat_q},{lon_q}",
+        timeout=ELEVATION_API_TIMEOUT)
+    if elevation_response.status_code != 200:
+        logger.warning(f"Elevation API not responding. Is the server running and the url set? Check Elevation API logs if needed")
+        raise ElevationAPIException("ELEVATION API NO RESPONSE")
+    try:
+        elevation = orjson.loads(elevation_response.content)["results"][0]["elevation"]
+    except (orjson.JSONDecodeError, LookupError, TypeError):
+        elevation = None
+    if not isinstance(elevation, (int, float)) or isinstance(elevation, bool):
+        logger.warning(f"Elevation API response malformed")
+        raise ElevationAPIException("ELEVATION_API MALFORMED")
+    return elevation
+
 
-    # Generic fields
-    req['launch_latitude'] = \
-        _extract_parameter(data, "launch_latitude", float,
-                           validator=lambda x: -90 <= x <= 90)
-    req['launch_longitude'] = \
-        _extract_parameter(data, "launch_longitude", float,
-                           validator=lambda x: 0 <= x < 360)
-    req['launch_datetime'] = \
-        _extract_parameter(data, "launch_datetime", _rfc3339_to_timestamp)
-    req['launch_altitude'] = \
-        _extract_parameter(data, "launch_altitude", float, ignore=True)
-
-    req['format'] = \
-        _extract_parameter(data, "format", str, STANDARD_FORMAT)
-
-    # If no launch altitude provided, use Ruaumoko to look it up
-    if req['launch_altitude'] is None:
-        try:
-            elevation_api_url = app.config.get('ELEVATION_API')
-            elevation_response = requests.get(f"{elevation_api_url}/api/v1/lookup?locations={req['launch_latitude']},{req['launch_longitude']}")
-            if elevation_response.status_code == 200:
-                try:
-                    launch_altitude = elevation_response.json()["results"][0]["elevation"]
-                except json.decoder.JSONDecodeError:
-                    logger.warning(f"Elevation API response malformed")
-                    raise ElevationAPIException("ELEVATION_API MALFORMED")
-            else:
-                logger.warning(f"Elevation API not responding. Is the server running and the url set? Check Elevation API logs if needed")
-                raise ElevationAPIException("ELEVATION API NO RESPONSE")
-        except Exception as e:
-            # Cannot query Ruaumoko - just set launch altitude to 0.
-            logger.debug(e)
-            logger.warning("Defaulting to 0.0 for launch altitude")
-            req['launch_altitude'] = 0.0
-            # raise InternalException("Internal exception experienced whilst " +
-            #                         "looking up 'launch_altitude'.")
+def _get_launch_altitude(lat, lon):
+    """
+    Look up the launch altitude at (`lat`, `lon`), defaulting to 0.0 if the
+    elevation API cannot be queried.
+    """
+    try:
+        return _lookup_elevation(round(lat, 3), round(lon, 3))
+    except (requests.RequestException, ElevationAPIException) as e:
+        # Cannot query Ruaumoko - just set launch altitude to 0.
+        logger.debug(e)
+        logger.warning("Defaulting to 0.0 for launch altitude")
+        return 0.0
+
+
+# Wind Dataset ################################################################
+# Maps a requested dataset (a UNIX timestamp, LATEST_DATASET_KEYWORD or a
+# dataset time) to (dataset, time opened).
+_ds_cache = {}
+_ds_cache_lock = threading.Lock()
+
+
+def _get_dataset(dataset):
+    """
+    Open the wind dataset for `dataset`, re-using one opened within the last
+    DATASET_CACHE_TTL seconds. The TTL bounds how long it takes to notice a
+    newer dataset on disk.
+
+    `dataset` is LATEST_DATASET_KEYWORD, a UNIX timestamp from the request,
+    or the :attr:`ds_time` of a dataset previously returned.
+    """
+    now = time.monotonic()
+    with _ds_cache_lock:
+        cached = _ds_cache.get(dataset)
+    if cached is not None and now - cached[1] < DATASET_CACHE_TTL:
+        return cached[0]
+
+    try:
+        if dataset == LATEST_DATASET_KEYWORD:
+            tawhiri_ds = WindDataset.open_latest(persistent=True,
+                                                 directory=WIND_DATASET_DIR)
+        elif isinstance(dataset, datetime):
+            tawhiri_ds = WindDataset(dataset, directory=WIND_DATASET_DIR)
         else:
-            req['launch_altitude'] = launch_altitude
+            tawhiri_ds = WindDataset(datetime.fromtimestamp(dataset),
+                                     directory=WIND_DATASET_DIR)
+    except IOError:
+        raise InvalidDatasetException("No matching dataset found.")
+    except ValueError as e:
+        raise InvalidDatasetException(*e.args)
 
-    # Prediction profile
-    req['profile'] = _extract_parameter(data, "profile", str,
-                                        PROFILE_STANDARD)
+    with _ds_cache_lock:
+        # Drop expired entries so that old datasets can be unmapped.
+        for key in [k for k, (_, opened) in _ds_cache.items()
+                    if now - opened >= DATASET_CACHE_TTL]:
+            del _ds_cache[key]
+        _ds_cache[dataset] = (tawhiri_ds, now)
+        _ds_cache[tawhiri_ds.ds_time] = (tawhiri_ds, now)
 
-    launch_alt = req["launch_altitude"]
+    return tawhiri_ds
 
-    if req['profile'] == PROFILE_STANDARD:
-        req['ascent_rate'] = rate_clip(_extract_parameter(data, "ascent_rate", float,
-                                                validator=lambda x: x > 0))
-        req['burst_altitude'] = \
-            _extract_parameter(data, "burst_altitude", float,
-                               validator=lambda x: x > launch_alt)
-        req['descent_rate'] = rate_clip(_extract_parameter(data, "descent_rate", float,
-                                                 validator=lambda x: x > 0))
-    elif req['profile'] == PROFILE_FLOAT:
-        req['ascent_rate'] = rate_clip(_extract_parameter(data, "ascent_rate", float,
-                                                validator=lambda x: x > 0))
-        req['float_altitude'] = \
-            _extract_parameter(data, "float_altitude", float,
-                               validator=lambda x: x > launch_alt)
-        req['stop_datetime'] = \
-            _extract_parameter(data, "stop_datetime", _rfc3339_to_timestamp,
-                               validator=lambda x: x > req['launch_datetime'])
-    elif req['profile'] == PROFILE_REVERSE:
-        req['ascent_rate'] = rate_clip(_extract_parameter(data, "ascent_rate", float,
-                                                validator=lambda x: x > 0))
+
+# Request #####################################################################
+# Profile specific parameters, all of which are required for that profile.
+_PROFILE_PARAMETERS = {
+    PROFILE_STANDARD: ("ascent_rate", "burst_altitude", "descent_rate"),
+    PROFILE_FLOAT: ("ascent_rate", "float_altitude", "stop_datetime"),
+    PROFILE_REVERSE: ("ascent_rate",),
+}
+_PROFILE_ONLY_PARAMETERS = frozenset(
+    name for parameters in _PROFILE_PARAMETERS.values() for name in parameters)
+
+
+class PredictionRequest(BaseModel):
+    """
+    The parameters of a prediction request.
+
+    Datetimes are given as RFC3339 timestamps and stored as UNIX timestamps.
+    Parameters which do not apply to the requested profile are discarded.
+    """
+    model_config = ConfigDict(allow_inf_nan=False)
+
+    launch_latitude: float = Field(ge=-90, le=90)
+    launch_longitude: float = Field(ge=0, lt=360)
+    launch_datetime: float
+    launch_altitude: Optional[float] = None
+    format: str = STANDARD_FORMAT
+    profile: Literal[PROFILE_STANDARD, PROFILE_FLOAT, PROFILE_REVERSE] = \
+        PROFILE_STANDARD
+    ascent_rate: Optional[float] = Field(None, gt=0)
+    burst_altitude: Optional[float] = None
+    descent_rate: Optional[float] = Field(None, gt=0)
+    float_altitude: Optional[float] = None
+    stop_datetime: Optional[float] = None
+    dataset: Union[float, Literal[LATEST_DATASET_KEYWORD]] = \
+        LATEST_DATASET_KEYWORD
+
+    @field_validator("launch_datetime", "stop_datetime", mode="before")
+    @classmethod
+    def _parse_datetime(cls, value):
+        return _rfc3339_to_timestamp(value)
+
+    @field_validator("dataset", mode="before")
+    @classmethod
+    def _parse_dataset(cls, value):
+        if value == LATEST_DATASET_KEYWORD:
+            return value
+        return _rfc3339_to_timestamp(value)
+
+    @field_validator("ascent_rate", "descent_rate")
+    @classmethod
+    def _clip_rate(cls, value):
+        return value if value is None else rate_clip(value)
+
+    @model_validator(mode="before")
+    @classmethod
+    def _discard_other_profiles(cls, data):
+        # Drop other profiles' parameters before they are validated, so that
+        # clients may send every field whatever the profile.
+        if not isinstance(data, dict):
+            return data
+        profile = data.get("profile", PROFILE_STANDARD)
+        if profile not in _PROFILE_PARAMETERS:
+            raise PydanticCustomError(
+                "unknown_profile", "Unknown profile '{profile}'.",
+                {"profile": profile})
+        parameters = _PROFILE_PARAMETERS[profile]
+        return {name: value for name, value in data.items()
+                if name in parameters or name not in _PROFILE_ONLY_PARAMETERS}
+
+    @model_validator(mode="after")
+    def _check_profile(self):
+        for name in _PROFILE_PARAMETERS[self.profile]:
+            if getattr(self, name) is None:
+                raise PydanticCustomError(
+                    "missing", "Parameter '{parameter}' not provided in request.",
+                    {"parameter": name})
+
+        if self.stop_datetime is not None and \
+                not self.stop_datetime > self.launch_datetime:
+            raise PydanticCustomError(
+                "value_error", "Invalid value for parameter 'stop_datetime': {value}.",
+                {"value": _timestamp_to_rfc3339(self.stop_datetime)})
+        return self
+
+
+def _request_exception(error):
+    """
+    Describe the first problem in a pydantic :exc:`ValidationError` as a
+    :exc:`RequestException`.
+    """
+    details = error.errors()[0]
+    if not details['loc']:
+        return RequestException(details['msg'])
+
+    parameter = details['loc'][0]
+    if details['type'] == 'missing':
+        return RequestException("Parameter '%s' not provided in request." %
+                                parameter)
+    elif details['type'] == 'value_error' or \
+            details['type'].endswith('_parsing'):
+        return RequestException("Unable to parse parameter '%s': %s." %
+                                (parameter, details['input']))
     else:
-        raise RequestException("Unknown profile '%s'." % req['profile'])
+        return RequestException("Invalid value for parameter '%s': %s." %
+                                (parameter, details['input']))
 
-    # Dataset
-    req['dataset'] = _extract_parameter(data, "dataset", _rfc3339_to_timestamp,
-                                        LATEST_DATASET_KEYWORD)
 
+def parse_request(data):
+    """
+    Parse the request into a :class:`PredictionRequest`.
+
+    The launch altitude may still be unknown; the request is finished by
+    :func:`complete_request` once it has been looked up.
+    """
+    try:
+        return PredictionRequest.model_validate(dict(data))
+    except ValidationError as e:
+        raise _request_exception(e)
+
+
+def _lookup_elevation_if_needed(params):
+    """
+    Return the launch altitude for `params`: the one given in the request if
+    any, and otherwise the elevation at the launch site.
+    """
+    if params.launch_altitude is not None:
+        return params.launch_altitude
+    # Reverse predictions start from a position in flight rather than on the
+    # ground, so the ground elevation is of no use there.
+    if params.profile == PROFILE_REVERSE:
+        return 0.0
+    return _get_launch_altitude(params.launch_latitude, params.launch_longitude)
+
+
+def complete_request(params, launch_altitude, data):
+    """
+    Set the launch altitude of `params`, check the parameters which depend on
+    it, and return the request as a dict.
+    """
+    params.launch_altitude = launch_altitude
+
+    for name in ("burst_altitude", "float_altitude"):
+        value = getattr(params, name)
+        if value is not None and not value > params.launch_altitude:
+            raise RequestException("Invalid value for parameter '%s': %s." %
+                                   (name, data[name]))
+
+    req = {"version": API_VERSION}
+    req.update(params.model_dump(exclude_none=True))
     return req
 
+
 def parse_request_datasetcheck(data):
     """
     Dataset Check Request - try and find a dataset, any dataset, and return its info is there is one.
@@ -217,84 +521,84 @@ def parse_request_datasetcheck(data):
         "request": req,
     }
 
-    warningcounts = WarningCounts()
-
-    # Find wind data location
-    ds_dir = app.config.get('WIND_DATASET_DIR', WindDataset.DEFAULT_DIRECTORY)
-
     # Dataset
     try:
-        tawhiri_ds = WindDataset.open_latest(persistent=True, directory=ds_dir)
+        tawhiri_ds = _get_dataset(LATEST_DATASET_KEYWORD)
         # Note that hours and minutes are set to 00 as Tawhiri uses hourly datasets
         resp['request']['dataset'] = \
             tawhiri_ds.ds_time.strftime("%Y-%m-%dT%H:00:00Z")
-    except IOError:
-        raise InvalidDatasetException("No matching dataset found.")
-    except ValueError as e:
-        raise InvalidDatasetException("Could not find any dataset.")
     except Exception as e:
         raise InvalidDatasetException("Could not find any dataset.")
     
-    resp["warnings"] = warningcounts.to_dict()
+    # No prediction is run, so no warnings can have fired.
+    resp["warnings"] = {}
 
     return resp
 
-def _extract_parameter(data, parameter, cast, default=None, ignore=False,
-                       validator=None):
+
+# Solver ######################################################################
+_solver_pool = None
+_solver_pool_lock = threading.Lock()
+
+
+def _worker_init(settings):
     """
-    Extract a parameter from the POST request and raise an exception if any
-    parameter is missing or invalid.
+    Initialise a solver worker process with the server's `settings`, and open
+    the latest dataset ahead of the first prediction.
     """
-    if parameter not in data:
-        if default is None and not ignore:
-            raise RequestException("Parameter '%s' not provided in request." %
-                                   parameter)
-        return default
-
+    configure(settings)
     try:
-        result = cast(data[parameter])
-    except Exception:
-        raise RequestException("Unable to parse parameter '%s': %s." %
-                               (parameter, data[parameter]))
+        _get_dataset(LATEST_DATASET_KEYWORD)
+    except Exception as e:
+        logger.debug(e)
 
-    if validator is not None and not validator(result):
-        raise RequestException("Invalid value for parameter '%s': %s." %
-                               (parameter, data[parameter]))
 
-    return result
+def _get_solver_pool():
+    """
+    Return the pool of worker processes which run the solver, or None if
+    SOLVER_PROCESSES is 0 and predictions are solved in-process.
+    """
+    global _solver_pool
+    if not SOLVER_PROCESSES:
+        return None
+    with _solver_pool_lock:
+        if _solver_pool is None:
+            settings = {'ELEVATION_API': ELEVATION_API_URL,
+                        'WIND_DATASET_DIR': WIND_DATASET_DIR}
+            # Workers are started from a clean forkserver process, rather than
+            # forked from this one, so that they cannot inherit locks (e.g.
+            # _ds_cache_lock, or loguru's) held by other threads at the time.
+            _solver_pool = ProcessPoolExecutor(
+                max_workers=SOLVER_PROCESSES,
+                mp_context=multiprocessing.get_context("forkserver"),
+                initializer=_worker_init, initargs=(settings,))
+    return _solver_pool
 
 
-# Response ####################################################################
-def run_prediction(req):
+def _discard_solver_pool(pool):
     """
-    Run the prediction.
+    Drop `pool`, e.g. once it is broken by a worker dying, so that the next
+    prediction starts a new one.
     """
-    # Response dict
-    resp = {
-        "request": req,
-        "prediction": [],
-    }
+    global _solver_pool
+    with _solver_pool_lock:
+        if _solver_pool is pool:
+            _solver_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
 
-    warningcounts = WarningCounts()
 
-    # Find wind data location
-    ds_dir = app.config.get('WIND_DATASET_DIR', WindDataset.DEFAULT_DIRECTORY)
-    elevation_api_url = app.config.get('ELEVATION_API')
+def _run_solve(req, ds_time):
+    """
+    Build the model chain and run the solver for `req`, using the dataset
+    for `ds_time`.
 
-    # Dataset
-    try:
-        if req['dataset'] == LATEST_DATASET_KEYWORD:
-            tawhiri_ds = WindDataset.open_latest(persistent=True, directory=ds_dir)
-        else:
-            tawhiri_ds = WindDataset(datetime.fromtimestamp(req['dataset']), directory=ds_dir)
-    except IOError:
-        raise InvalidDatasetException("No matching dataset found.")
-    except ValueError as e:
-        raise InvalidDatasetException(*e.args)
+    Only picklable values are passed in and returned, so that this may run
+    in a solver worker process. Returns a tuple of (solver result, warnings).
+    """
+    warningcounts = WarningCounts()
 
-    # Note that hours and minutes are set to 00 as Tawhiri uses hourly datasets
-    resp['request']['dataset'] = \
-            tawhiri_ds.ds_time.strftime("%Y-%m-%dT%H:00:00Z")
+    # Dataset
+    tawhiri_ds = _get_dataset(ds_time)
 
     # Stages
     if req['profile'] == PROFILE_STANDARD:
@@ -302,7 +606,7 @@ def run_prediction(req):
                                          req['burst_altitude'],
                                          req['descent_rate'],
                                          tawhiri_ds,
-                                         elevation_api_url,
+                                         ELEVATION_API_URL,
                                          warningcounts)
     elif req['profile'] == PROFILE_FLOAT:
         stages = models.float_profile(req['ascent_rate'],
@@ -313,7 +617,7 @@ def run_prediction(req):
     elif req['profile'] == PROFILE_REVERSE:
         stages = models.reverse_profile(req['ascent_rate'],
                                       tawhiri_ds,
-                                      elevation_api_url,
+                                      ELEVATION_API_URL,
                                       warningcounts)
     else:
         raise InternalException("No implementation for known profile.")
@@ -334,13 +638,61 @@ def run_prediction(req):
         raise PredictionException("Prediction did not complete: '%s'." %
                                   str(e))
 
-    # Format trajectory
+    return result, warningcounts.to_dict()
+
+
+async def _solve(req, ds_time):
+    """
+    Run :func:`_run_solve` in a solver worker process, or in the threadpool
+    if there are none, without blocking the event loop.
+    """
+    pool = _get_solver_pool()
+    if pool is None:
+        return await run_in_threadpool(_run_solve, req, ds_time)
+
+    try:
+        return await asyncio.wrap_future(pool.submit(_run_solve, req, ds_time))
+    except BrokenProcessPool:
+        logger.error("Solver worker process died; restarting the pool")
+        _discard_solver_pool(pool)
+        raise PredictionException(
+            "Prediction did not complete: solver process died.")
+
+
+# Response ####################################################################
+async def run_prediction(req, ds_time):
+    """
+    Run the prediction, using the dataset for `ds_time`.
+    """
+    result, warnings = await _solve(req, ds_time)
+    return await run_in_threadpool(_format_prediction, req, ds_time, result,
+                                   warnings)
+
+
+def _format_prediction(req, ds_time, result, warnings):
+    """
+    Build the response for `req` from the solver's `result` and `warnings`.
+    """
+    # Response dict
+    resp = {
+        "request": req,
+        "prediction": [],
+    }
+
+    # Note that hours and minutes are set to 00 as Tawhiri uses hourly datasets
+    resp['request']['dataset'] = ds_time.strftime("%Y-%m-%dT%H:00:00Z")
+
+    # Format trajectory. CSV and KML give longitudes in -180 to 180.
+    wrap_longitudes = req['format'] in ("csv", "kml")
     if req['profile'] == PROFILE_STANDARD:
-        resp['prediction'] = _parse_stages(["ascent", "descent"], result)
+        resp['prediction'] = _parse_stages(["ascent", "descent"], result,
+                                           wrap_longitudes)
     elif req['profile'] == PROFILE_FLOAT:
-        resp['prediction'] = _parse_stages(["ascent", "float"], result)
+        resp['prediction'] = _parse_stages(["ascent", "float"], result,
+                                           wrap_longitudes)
     elif req['profile'] == PROFILE_REVERSE:
-        resp['prediction'] = _parse_stages(["ascent", "descent"], result)
+        resp['prediction'] = _parse_stages(["ascent", "descent"], result,
+                                           wrap_longitudes)
         # Extract the last entry as our launch site estimate.
         _launch_site = resp['prediction'][-1]['trajectory'][-1]
         resp['launch_estimate'] = {
@@ -354,28 +706,36 @@ def run_prediction(req):
         raise InternalException("No implementation for known profile.")
 
     # Convert request UNIX timestamps to RFC3339 timestamps
-    for key in resp['request']:
-        if "datetime" in key:
-            resp['request'][key] = _timestamp_to_rfc3339(resp['request'][key])
+    resp['request']['launch_datetime'] = \
+        _timestamp_to_rfc3339(req['launch_datetime'])
+    if req['profile'] == PROFILE_FLOAT:
+        resp['request']['stop_datetime'] = \
+            _timestamp_to_rfc3339(req['stop_datetime'])
 
-    resp["warnings"] = warningcounts.to_dict()
+    resp["warnings"] = warnings
 
     return resp
 
 
-def _parse_stages(labels, data):
+def _parse_stages(labels, data, wrap_longitudes=False):
     """
     Parse the predictor output for a set of stages.
+
+    If `wrap_longitudes`, longitudes are converted from 0 to 360 to -180 to
+    180 as the points are built, rather than in a second pass.
     """
-    assert len(labels) == len(data)
+    # solver.solve returns a list of stages, so len() does not consume it.
+    if __debug__ and len(labels) != len(data):
+        raise InternalException("Solver returned %d stages, expected %d." %
+                                (len(data), len(labels)))
 
     prediction = []
-    for index, leg in enumerate(data):
+    for label, leg in zip(labels, data):
         stage = {}
-        stage['stage'] = labels[index]
+        stage['stage'] = label
         stage['trajectory'] = [{
             'latitude': lat,
-            'longitude': lon,
+            'longitude': lon - 360.0 if wrap_longitudes and lon > 180.0 else lon,
             'altitude': alt,
             'datetime': _timestamp_to_rfc3339(dt),
             } for dt, lat, lon, alt in leg]
@@ -383,56 +743,93 @@ def _parse_stages(labels, data):
     return prediction
 
 
-# Flask App ###################################################################
-@app.route('/api/v{0}/'.format(API_VERSION), methods=['GET'])
-def main():
+# FastAPI App #################################################################
+@app.get('/api/v{0}/'.format(API_VERSION))
+async def main(request: Request):
     """
     Single API endpoint which accepts GET requests.
     """
-    g.request_start_time = time.time()
-    response = run_prediction(parse_request(request.args))
-    g.request_complete_time = time.time()
-    response['metadata'] = _format_request_metadata()
+    request.state.request_start_time = time.time()
+    params = parse_request(request.query_params)
+
+    # The elevation lookup and opening the dataset both block, but are
+    # independent, so run them in the threadpool concurrently.
+    launch_altitude, tawhiri_ds = await asyncio.gather(
+        run_in_threadpool(_lookup_elevation_if_needed, params),
+        run_in_threadpool(_get_dataset, params.dataset))
+    req = complete_request(params, launch_altitude, request.query_params)
+
+    response = await run_prediction(req, tawhiri_ds.ds_time)
+    request.state.request_complete_time = time.time()
+    response['metadata'] = _format_request_metadata(request)
 
     # Format the result data as per the users request
     if response["request"]["format"] == "csv":
-        _formatted = format_csv(fix_data_longitudes(response))
-        return send_file(
-            BytesIO(_formatted['data'].encode()),
-            mimetype="text/csv",
-            as_attachment=True,
-            attachment_filename=_formatted['filename']
+        _formatted = format_csv(response)
+        return Response(
+            _formatted['data'],
+            media_type="text/csv",
+            headers=_attachment_headers(_formatted['filename'])
         )
 
     elif response["request"]["format"] == "kml":
-        _formatted = format_kml(fix_data_longitudes(response))
-        return send_file(
-            BytesIO(_formatted['data'].encode()),
-            as_attachment=True,
-            attachment_filename=_formatted['filename']
+        _formatted = format_kml(response)
+        return Response(
+            _formatted['data'],
+            media_type="application/vnd.google-earth.kml+xml",
+            headers=_attachment_headers(_formatted['filename'])
         )
 
     elif response["request"]["format"] == "json":
-        return jsonify(response)
+        return ORJSONResponse(response)
     else:
         raise InternalException("Format not supported: " + response["request"]["format"])
 
 
 
-@app.route('/api/datasetcheck', methods=['GET'])
-def main_datasetcheck():
+@app.get('/api/datasetcheck')
+async def main_datasetcheck(request: Request):
     """
     Dataset Check Endpoint
     """
-    g.request_start_time = time.time()
-    response = parse_request_datasetcheck(request.args)
-    g.request_complete_time = time.time()
-    response['metadata'] = _format_request_metadata()
-    return jsonify(response)
+    request.state.request_start_time = time.time()
+    response = await run_in_threadpool(parse_request_datasetcheck,
+                                       request.query_params)
+    request.state.request_complete_time = time.time()
+    response['metadata'] = _format_request_metadata(request)
+    return ORJSONResponse(response)
+
+
+def _check_admin_token(request):
+    """
+    Check that `request` carries ``Authorization: Bearer <ADMIN_TOKEN>``.
+
+    Without an ADMIN_TOKEN the admin endpoints are disabled, and respond as
+    if they did not exist.
+    """
+    if ADMIN_TOKEN is None:
+        raise HTTPException(status_code=404)
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or \
+            not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise AuthorizationException("Admin token missing or incorrect.")
+
+
+@app.post('/admin/flush')
+async def admin_flush(request: Request):
+    """
+    Drop all cached lookups and datasets, e.g. after the data has changed.
+    """
+    request.state.request_start_time = time.time()
+    _check_admin_token(request)
+    _lookup_elevation.cache_clear()
+    with _ds_cache_lock:
+        _ds_cache.clear()
+    return ORJSONResponse({"flushed": ["elevation", "dataset"]})
 
 
-@app.errorhandler(APIException)
-def handle_exception(error):
+@app.exception_handler(APIException)
+async def handle_exception(request: Request, error: APIException):
     """
     Return correct error message and HTTP status code for API exceptions.
     """
@@ -442,24 +839,28 @@ def handle_exception(error):
         "description": str(error)
     }
     logger.error(error)
-    g.request_complete_time = time.time()
-    response['metadata'] = _format_request_metadata()
-    return jsonify(response), error.status_code
+    request.state.request_complete_time = time.time()
+    response['metadata'] = _format_request_metadata(request)
+    return ORJSONResponse(response, status_code=error.status_code)
 
 
 # Uncomment for local testing
-# @app.after_request # blueprint can also be app~~
-# def after_request(response):
-#     header = response.headers
-#     header['Access-Control-Allow-Origin'] = '*'
-#     return response
+# from fastapi.middleware.cors import CORSMiddleware
+# app.add_middleware(CORSMiddleware, allow_origins=['*'])
+
+
+def _attachment_headers(filename):
+    """
+    Headers which present the response body as a file download.
+    """
+    return {"Content-Disposition": f'attachment; filename="{filename}"'}
 
 
-def _format_request_metadata():
+def _format_request_metadata(request):
     """
     Format the request metadata for inclusion in the response.
     """
     return {
-        "start_datetime": _timestamp_to_rfc3339(g.request_start_time),
-        "complete_datetime": _timestamp_to_rfc3339(g.request_complete_time),
+        "start_datetime": _timestamp_to_rfc3339(request.state.request_start_time),
+        "complete_datetime": _timestamp_to_rfc3339(request.state.request_complete_time),
     }
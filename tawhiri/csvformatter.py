@@ -16,23 +16,18 @@
 # along with Tawhiri.  If not, see <http://www.gnu.org/licenses/>.
 from dateutil.parser import parse
 
-def fix_data_longitudes(data):
-    """ Fix all the longitudes in the prediction trajectory to -180 to 180. """
+def _csv_lines(data):
+    """ Yield the lines of a Tawhiri prediction formatted as CSV """
+    yield "datetime,latitude,longitude,altitude\n"
     for stage in data["prediction"]:
         for point in stage["trajectory"]:
-            if point['longitude'] > 180.0:
-                point['longitude'] = point['longitude'] - 360.0
-
-    return data
+            yield f"{point['datetime']},{point['latitude']:.5f},{point['longitude']:.5f},{point['altitude']:.1f}\n"
 
 def format_csv(data):
-    """ Format a Tawhiri prediction as CSV """
+    """ Format a Tawhiri prediction as CSV.
 
-    # Generate CSV data.
-    _output = "datetime,latitude,longitude,altitude\n"
-    for stage in data["prediction"]:
-        for point in stage["trajectory"]:
-            _output += f"{point['datetime']},{point['latitude']:.5f},{point['longitude']:.5f},{point['altitude']:.1f}\n"
+    The lines are joined once, rather than by repeated concatenation.
+    """
 
     # Generate filename
     _start_datestr = data["request"]["launch_datetime"]
@@ -47,5 +42,5 @@ def format_csv(data):
 
     return {
         "filename": _filename, 
-        "data": _output
+        "data": "".join(_csv_lines(data))
     }
\ No newline at end of file
@@ -16,14 +16,51 @@
 # along with Tawhiri.  If not, see <http://www.gnu.org/licenses/>.
 from dateutil.parser import parse
 
-def format_kml(data):
-    """ Format a Tawhiri prediction as KML """
+def _kml_chunks(data, flight_info, linestr_description, placemarks):
+    """ Yield a Tawhiri prediction formatted as KML, in chunks """
+
+    yield f"""<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+<Document>
+<name>Flight Path</name>
+<description>{flight_info}</description>
+<Style id="yellowPoly">
+<LineStyle>
+<color>7f00ffff</color>
+<width>4</width>
+</LineStyle>
+<PolyStyle>
+<color>7f00ff00</color>
+</PolyStyle>
+</Style>
+<Placemark>
+<name>Flight path</name>
+<description>{linestr_description}</description>
+<styleUrl>#yellowPoly</styleUrl>
+<LineString>
+<extrude>1</extrude>
+<tesselate>1</tesselate>
+<altitudeMode>absolute</altitudeMode>
+<coordinates>
+"""
 
-    # Generate LineString coordinates
-    _linestring_coords = ""
+    # LineString coordinates
     for stage in data["prediction"]:
         for point in stage["trajectory"]:
-            _linestring_coords += f"{point['longitude']:.5f},{point['latitude']:.5f},{point['altitude']:.1f}\n"
+            yield f"{point['longitude']:.5f},{point['latitude']:.5f},{point['altitude']:.1f}\n"
+
+    yield f"""
+</coordinates>
+</LineString></Placemark>
+{placemarks}
+</Document></kml>
+"""
+
+def format_kml(data):
+    """ Format a Tawhiri prediction as KML.
+
+    The chunks are joined once, rather than by repeated concatenation.
+    """
 
     # Flight Path Descriptions
     if data['request']['profile'] == "standard_profile":
@@ -130,37 +167,6 @@ def format_kml(data):
     else:
         raise InternalException("Unknown Flight Profile for KML export.")
 
-    # Generate the final KML output
-    _output = f"""<?xml version="1.0" encoding="UTF-8"?>
-<kml xmlns="http://www.opengis.net/kml/2.2">
-<Document>
-<name>Flight Path</name>
-<description>{_flight_info}</description>
-<Style id="yellowPoly">
-<LineStyle>
-<color>7f00ffff</color>
-<width>4</width>
-</LineStyle>
-<PolyStyle>
-<color>7f00ff00</color>
-</PolyStyle>
-</Style>
-<Placemark>
-<name>Flight path</name>
-<description>{_linestr_description}</description>
-<styleUrl>#yellowPoly</styleUrl>
-<LineString>
-<extrude>1</extrude>
-<tesselate>1</tesselate>
-<altitudeMode>absolute</altitudeMode>
-<coordinates>
-{_linestring_coords}
-</coordinates>
-</LineString></Placemark>
-{_placemarks}
-</Document></kml>
-"""
-
     # Generate filename
     _start_datestr = data["request"]["launch_datetime"]
     _start_datetime = parse(_start_datestr)
@@ -174,5 +180,5 @@ def format_kml(data):
 
     return {
         "filename": _filename, 
-        "data": _output
+        "data": "".join(_kml_chunks(data, _flight_info, _linestr_description, _placemarks))
     }
\ No newline at end of file
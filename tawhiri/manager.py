@@ -18,30 +18,46 @@
 Command-line manager for API webapp
 
 """
+import argparse
 import os
-from flask import send_file, send_from_directory, redirect, url_for
-# Change import to work with flask 1.1.4
-#from flask.ext.script import Manager
-from flask_script import Manager
-from .api import app
-manager = Manager(app)
+
+import uvicorn
+from fastapi.responses import RedirectResponse
+from fastapi.staticfiles import StaticFiles
+
+from .api import app, configure
+
+
+def _load_settings(filename):
+    """
+    Load the upper-case names defined in the Python file `filename`.
+    """
+    settings = {"__file__": filename}
+    with open(filename) as f:
+        exec(compile(f.read(), filename, "exec"), settings)
+    return {k: v for k, v in settings.items() if k.isupper()}
+
 
 def main():
+    parser = argparse.ArgumentParser(prog="tawhiri-webapp")
+    commands = parser.add_subparsers(dest="command", required=True)
+    runserver = commands.add_parser("runserver",
+                                    help="run the development web-server")
+    runserver.add_argument("--host", default="127.0.0.1")
+    runserver.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    settings = {}
     if 'TAWHIRI_SETTINGS' in os.environ:
-        app.config.from_envvar('TAWHIRI_SETTINGS')
+        settings = _load_settings(os.environ['TAWHIRI_SETTINGS'])
+    configure(settings)
 
-    ui_dir = app.config.get('UI_DIR')
+    ui_dir = settings.get('UI_DIR')
     if ui_dir is not None:
-        @app.route('/ui/<path:path>')
-        def send_ui(path):
-            return send_from_directory(ui_dir, path)
-
-        @app.route('/ui/')
-        def send_index():
-            return send_file(os.path.join(ui_dir, 'index.html'))
+        app.mount('/ui', StaticFiles(directory=ui_dir, html=True), name='ui')
 
-        @app.route('/')
-        def send_ui_redirect():
-            return redirect(url_for('send_index'))
+        @app.get('/', include_in_schema=False)
+        async def send_ui_redirect():
+            return RedirectResponse('/ui/')
 
-    return manager.run()
+    uvicorn.run(app, host=args.host, port=args.port)
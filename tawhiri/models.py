@@ -21,6 +21,7 @@ functions to combine models and termination conditions.
 """
 
 import calendar
+import functools
 import math
 from loguru import logger
 import requests
@@ -34,10 +35,16 @@ class ElevationAPIException(Exception):
 _PI_180 = math.pi / 180.0
 _180_PI = 180.0 / math.pi
 
+# Factories which depend only on their (numeric) arguments return stateless
+# functions, so they are memoised: clients commonly repeat the same profile.
+# Factories closing over a dataset or WarningCounts must not be memoised.
+_memoise = functools.lru_cache(maxsize=256)
+
 
 ## Up/Down Models #############################################################
 
 
+@_memoise
 def make_constant_ascent(ascent_rate):
     """Return a constant-ascent model at `ascent_rate` (m/s)"""
     def constant_ascent(t, lat, lng, alt):
@@ -45,6 +52,7 @@ def make_constant_ascent(ascent_rate):
     return constant_ascent
 
 
+@_memoise
 def make_drag_descent(sea_level_descent_rate):
     """Return a descent-under-parachute model with sea level descent
        `sea_level_descent_rate` (m/s). Descent rate at altitude is determined
@@ -119,6 +127,7 @@ def make_reverse_wind_velocity(dataset, warningcounts):
 ## Termination Criteria #######################################################
 
 
+@_memoise
 def make_burst_termination(burst_altitude):
     """Return a burst-termination criteria, which terminates integration
        when the altitude reaches `burst_altitude`.
@@ -163,6 +172,7 @@ def make_elevation_data_termination(elevation_api_url=None):
         return (position_altitude > alt) or (alt <= 0)
     return tc
 
+@_memoise
 def make_time_termination(max_time):
     """A time based termination criteria, which terminates integration when
        the current time is greater than `max_time` (a UNIX timestamp).
@@ -33,16 +33,15 @@ cdef class WarningCounts:
         return bool(self.altitude_too_high)
 
     def to_dict(self):
-        res = \
-            { "altitude_too_high":
+        # Only warnings which fired are included; a fresh dict is built on
+        # every call.
+        res = {}
+
+        if self.altitude_too_high:
+            res["altitude_too_high"] = \
                 { "count": self.altitude_too_high
                 , "description": "The altitude went too high, above the max forecast wind. "
                                  "Wind data will be unreliable"
                 }
-            }
-
-        for key in list(res.keys()):
-            if res[key]["count"] == 0:
-                del res[key]
 
         return res
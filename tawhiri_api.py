@@ -1,9 +1,14 @@
 from tawhiri import api
 import os
 
+# Run with e.g.:
+#   gunicorn -k uvicorn_worker.UvicornWorker --timeout 120 -w 2 tawhiri_api:app
+#
+# tawhiri.api reads its settings (e.g. SOLVER_PROCESSES, ADMIN_TOKEN) from the
+# environment; in the container ELEVATION_API is required and the datasets
+# are in /grib unless WIND_DATASET_DIR says otherwise.
 app = api.app
-app.config["ELEVATION_API"] = os.environ["ELEVATION_API"]
-app.config["WIND_DATASET_DIR"] = "/grib"
-
-if __name__ == '__main__':
-    app.run(host="0.0.0.0", debug=True)
+api.configure({
+    "ELEVATION_API": os.environ["ELEVATION_API"],
+    "WIND_DATASET_DIR": os.environ.get("WIND_DATASET_DIR", "/grib"),
+})
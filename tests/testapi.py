@@ -1,20 +1,34 @@
 from __future__ import print_function
 
+import asyncio
 import json
+import os
+import strict_rfc3339
+from datetime import datetime
+from unittest import TestCase
 
-from flask_testing import TestCase
+from fastapi.testclient import TestClient
 from mock import patch, MagicMock
 from urllib.parse import urlencode
 
-from tawhiri.api import app
+from tawhiri import api
+from tawhiri.api import app, _lookup_elevation, _ds_cache
+from tawhiri.api import _get_launch_altitude, _get_dataset
+from tawhiri.api import run_prediction, PredictionException
+from tawhiri.api import _rfc3339_to_timestamp, _timestamp_to_rfc3339
 
 # Root path for v1 API
 API_ROOT = '/api/v1/'
 
 class BasicApiTest(TestCase):
-    def create_app(self):
-        app.debug = True
-        return app
+    def setUp(self):
+        # Solve in-process, where the mocks below apply.
+        patcher = patch('tawhiri.api.SOLVER_PROCESSES', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(app)
+        _lookup_elevation.cache_clear()
+        _ds_cache.clear()
 
     def test_root_get(self):
         """Check that simply GET-ing the API root with no parameters results in
@@ -25,18 +39,68 @@ class BasicApiTest(TestCase):
         response = self.client.get(API_ROOT)
 
         # Check request is right type with a JSON body
-        self.assert400(response)
-        json_body = response.json
+        self.assertEqual(response.status_code, 400)
+        json_body = response.json()
         self.assertIsNotNone(json_body)
 
         # Response should have an error description.
         self.assertIn('error', json_body)
 
+    def test_missing_profile_parameter(self):
+        """Check that omitting a parameter required by the chosen profile
+        results in a 400 response naming the parameter.
+
+        """
+        qs = dict(
+            launch_latitude=52.1, launch_longitude=0.3, launch_altitude=0,
+            launch_datetime='2014-08-19T23:00:00Z',
+            profile='float_profile', ascent_rate=5, float_altitude=30000,
+        )
+        response = self.client.get(API_ROOT + '?' + urlencode(qs))
+
+        self.assertEqual(response.status_code, 400)
+        error = response.json()['error']
+        self.assertEqual(error['type'], 'RequestException')
+        self.assertIn('stop_datetime', error['description'])
+
+    def test_unknown_profile(self):
+        qs = dict(
+            launch_latitude=52.1, launch_longitude=0.3, launch_altitude=0,
+            launch_datetime='2014-08-19T23:00:00Z', profile='balloon',
+        )
+        response = self.client.get(API_ROOT + '?' + urlencode(qs))
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['error']['description'],
+                         "Unknown profile 'balloon'.")
+
+    @patch('tawhiri.models.standard_profile')
+    @patch('tawhiri.solver.solve')
+    @patch('tawhiri.api.WindDataset')
+    def test_other_profile_parameters_ignored(self, wind_ds_mock, solve_mock,
+                                              profile_mock):
+        """Parameters for other profiles are ignored, even if unparsable."""
+        qs = dict(
+            launch_latitude=52.1, launch_longitude=0.3, launch_altitude=0,
+            launch_datetime='2014-08-19T23:00:00Z',
+            ascent_rate=5, descent_rate=10, burst_altitude=30000,
+            float_altitude='x', stop_datetime='garbage',
+        )
+        wind_ds_mock.open_latest().ds_time = datetime(2014, 8, 19, 18)
+        solve_mock.configure_mock(return_value=[[[1, 52, 0, 0]], [[2, 53, 0, 0]]])
+
+        response = self.client.get(API_ROOT + '?' + urlencode(qs))
+
+        self.assertEqual(response.status_code, 200)
+        request = response.json()['request']
+        self.assertNotIn('float_altitude', request)
+        self.assertNotIn('stop_datetime', request)
+
     @patch('tawhiri.models.standard_profile')
     @patch('tawhiri.solver.solve')
     @patch('tawhiri.api.WindDataset')
-    @patch('tawhiri.api.ruaumoko_ds')
-    def test_simple_run(self, ruaumoko_ds_mock, wind_ds_mock, solve_mock, profile_mock):
+    @patch('tawhiri.api._elev_session')
+    def test_simple_run(self, elev_session_mock, wind_ds_mock, solve_mock, profile_mock):
         """Make a simple request for a landing prediction."""
 
         # The minimum number of parameters for a prediction is lat, long and
@@ -51,7 +115,9 @@ class BasicApiTest(TestCase):
         # We need to mock various tawhiri components:
 
         # Mock ruaumoko's elevation API to always return 5m.
-        ruaumoko_ds_mock().get = MagicMock(return_value=5)
+        elev_session_mock.get.return_value.status_code = 200
+        elev_session_mock.get.return_value.content = \
+            b'{"results": [{"elevation": 5}]}'
 
         # Mock latest dataset's strftime
         wind_ds_mock.open_latest().ds_time.strftime = MagicMock(return_value='strftime_mock')
@@ -67,17 +133,18 @@ class BasicApiTest(TestCase):
         response = self.client.get(API_ROOT + '?' + urlencode(qs))
 
         # Check that ruaumoko was asked about launch altitude.
-        ruaumoko_ds_mock().get.assert_called_with(
-            qs['launch_latitude'], qs['launch_longitude']
-        )
+        elev_session_mock.get.assert_called_once()
+        self.assertIn('locations={0},{1}'.format(
+            qs['launch_latitude'], qs['launch_longitude']),
+            elev_session_mock.get.call_args[0][0])
 
         # Response should always be JSON
-        self.assertIsNotNone(response.json)
-        body = response.json
+        body = response.json()
+        self.assertIsNotNone(body)
         print('Response body:', json.dumps(body, indent=2))
 
         # Check response succeeded
-        self.assert200(response)
+        self.assertEqual(response.status_code, 200)
 
         # Check strftime mock
         self.assertEqual(body['request']['dataset'], 'strftime_mock')
@@ -93,3 +160,295 @@ class BasicApiTest(TestCase):
             self.assertEqual(len(expected), len(leg['trajectory']))
 
             # TODO: Compare results for equality
+
+
+class FormatTest(TestCase):
+    """CSV and KML output should be unchanged from the original formatters."""
+
+    # Two points east of the antimeridian check longitude wrapping.
+    PREDICTION = [
+        [[1408489200, 52.1, 359.5, 0], [1408489260.5, 52.2, 359.9, 300]],
+        [[1408489320, 52.3, 0.25, 0]],
+    ]
+
+    EXPECTED_CSV = (
+        "datetime,latitude,longitude,altitude\n"
+        "2014-08-19T23:00:00Z,52.10000,-0.50000,0.0\n"
+        "2014-08-19T23:01:00.5Z,52.20000,-0.10000,300.0\n"
+        "2014-08-19T23:02:00Z,52.30000,0.25000,0.0\n"
+    )
+
+    EXPECTED_KML = """<?xml version="1.0" encoding="UTF-8"?>
+<kml xmlns="http://www.opengis.net/kml/2.2">
+<Document>
+<name>Flight Path</name>
+<description>Flight Data for start time 2014-08-19T23:00:00Z, at site: 52.1000,359.5000, standard flight profile.</description>
+<Style id="yellowPoly">
+<LineStyle>
+<color>7f00ffff</color>
+<width>4</width>
+</LineStyle>
+<PolyStyle>
+<color>7f00ff00</color>
+</PolyStyle>
+</Style>
+<Placemark>
+<name>Flight path</name>
+<description>Ascent rate: 5.0, descent rate: 10.0, with burst at 30000.0m.</description>
+<styleUrl>#yellowPoly</styleUrl>
+<LineString>
+<extrude>1</extrude>
+<tesselate>1</tesselate>
+<altitudeMode>absolute</altitudeMode>
+<coordinates>
+-0.50000,52.10000,0.0
+-0.10000,52.20000,300.0
+0.25000,52.30000,0.0
+
+</coordinates>
+</LineString></Placemark>
+
+<Placemark>
+<name>Balloon Launch</name>
+<description>Balloon launch at 52.10000,-0.50000, at 2014-08-19T23:00:00Z.</description>
+<Point><altitudeMode>absolute</altitudeMode><coordinates>-0.50000,52.10000,0.0</coordinates></Point>
+</Placemark>
+
+<Placemark>
+<name>Balloon Burst</name>
+<description>Balloon burst at 52.20000,-0.10000, at 2014-08-19T23:01:00.5Z.</description>
+<Point><altitudeMode>absolute</altitudeMode><coordinates>-0.10000,52.20000,300.0</coordinates></Point>
+</Placemark>
+
+<Placemark>
+<name>Balloon Landing</name>
+<description>Balloon landing at 52.30000,0.25000, at 2014-08-19T23:02:00Z.</description>
+<Point><altitudeMode>absolute</altitudeMode><coordinates>0.25000,52.30000,0.0</coordinates></Point>
+</Placemark>
+
+</Document></kml>
+"""
+
+    def setUp(self):
+        patcher = patch('tawhiri.api.SOLVER_PROCESSES', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = TestClient(app)
+        _ds_cache.clear()
+        self.addCleanup(_ds_cache.clear)
+
+    @patch('tawhiri.models.standard_profile')
+    @patch('tawhiri.solver.solve')
+    @patch('tawhiri.api.WindDataset')
+    def _get(self, fmt, wind_ds_mock, solve_mock, profile_mock):
+        wind_ds_mock.open_latest().ds_time = datetime(2014, 8, 19, 18)
+        solve_mock.configure_mock(return_value=self.PREDICTION)
+        qs = dict(
+            launch_latitude=52.1, launch_longitude=359.5, launch_altitude=0,
+            launch_datetime='2014-08-19T23:00:00Z',
+            ascent_rate=5, descent_rate=10, burst_altitude=30000,
+            format=fmt,
+        )
+        response = self.client.get(API_ROOT + '?' + urlencode(qs))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_csv(self):
+        response = self._get('csv')
+        self.assertEqual(response.text, self.EXPECTED_CSV)
+        self.assertEqual(
+            response.headers['content-disposition'],
+            'attachment; filename="20140819-230000Z_52.1000_359.5000_'
+            'standard_profile_2014081918Z.csv"')
+
+    def test_kml(self):
+        response = self._get('kml')
+        self.assertEqual(response.text, self.EXPECTED_KML)
+        self.assertEqual(
+            response.headers['content-disposition'],
+            'attachment; filename="20140819-230000Z_52.1000_359.5000_'
+            'standard_profile_2014081918Z.kml"')
+
+
+class CacheTest(TestCase):
+    def setUp(self):
+        self.client = TestClient(app)
+        _lookup_elevation.cache_clear()
+        _ds_cache.clear()
+        self.addCleanup(_lookup_elevation.cache_clear)
+        self.addCleanup(_ds_cache.clear)
+
+    @patch('tawhiri.api._elev_session')
+    def test_elevation_cached_per_site(self, elev_session_mock):
+        """Launches within ~100m of each other share one elevation lookup."""
+        elev_session_mock.get.return_value.status_code = 200
+        elev_session_mock.get.return_value.content = \
+            b'{"results": [{"elevation": 5}]}'
+
+        self.assertEqual(_get_launch_altitude(52.1, 0.3), 5)
+        self.assertEqual(_get_launch_altitude(52.10001, 0.30001), 5)
+        elev_session_mock.get.assert_called_once()
+
+    @patch('tawhiri.api._elev_session')
+    def test_elevation_failure_not_cached(self, elev_session_mock):
+        """A failed lookup defaults to 0.0 and is retried next time."""
+        elev_session_mock.get.return_value.status_code = 503
+        self.assertEqual(_get_launch_altitude(52.1, 0.3), 0.0)
+
+        elev_session_mock.get.return_value.status_code = 200
+        elev_session_mock.get.return_value.content = \
+            b'{"results": [{"elevation": 5}]}'
+        self.assertEqual(_get_launch_altitude(52.1, 0.3), 5)
+        self.assertEqual(elev_session_mock.get.call_count, 2)
+
+    @patch('tawhiri.api._elev_session')
+    def test_elevation_not_a_number(self, elev_session_mock):
+        """A response without a numeric elevation is treated as malformed."""
+        elev_session_mock.get.return_value.status_code = 200
+        for content in (b'{"results": [{"elevation": null}]}',
+                        b'{"results": [{"elevation": "5"}]}',
+                        b'{"results": [{}]}', b'[]', b'not json'):
+            elev_session_mock.get.return_value.content = content
+            self.assertEqual(_get_launch_altitude(52.1, 0.3), 0.0)
+        self.assertEqual(_lookup_elevation.cache_info().currsize, 0)
+
+    @patch('tawhiri.api.time.monotonic')
+    @patch('tawhiri.api.WindDataset')
+    def test_dataset_cache_expires(self, wind_ds_mock, monotonic_mock):
+        """Opened datasets are re-used until DATASET_CACHE_TTL has passed."""
+        monotonic_mock.return_value = 1000.0
+        first = _get_dataset('latest')
+        self.assertIs(_get_dataset('latest'), first)
+        self.assertIs(_get_dataset(first.ds_time), first)
+        wind_ds_mock.open_latest.assert_called_once()
+
+        monotonic_mock.return_value += api.DATASET_CACHE_TTL
+        _get_dataset('latest')
+        self.assertEqual(wind_ds_mock.open_latest.call_count, 2)
+
+    def test_flush_disabled_without_token(self):
+        with patch('tawhiri.api.ADMIN_TOKEN', None):
+            response = self.client.post('/admin/flush')
+        self.assertEqual(response.status_code, 404)
+
+    def test_flush_requires_token(self):
+        _ds_cache['latest'] = (MagicMock(), 0.0)
+        with patch('tawhiri.api.ADMIN_TOKEN', 'secret'):
+            response = self.client.post(
+                '/admin/flush', headers={'Authorization': 'Bearer wrong'})
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(response.json()['error']['type'],
+                         'AuthorizationException')
+        self.assertIn('latest', _ds_cache)
+
+    @patch('tawhiri.api._elev_session')
+    def test_flush(self, elev_session_mock):
+        elev_session_mock.get.return_value.status_code = 200
+        elev_session_mock.get.return_value.content = \
+            b'{"results": [{"elevation": 5}]}'
+        _get_launch_altitude(52.1, 0.3)
+        _ds_cache['latest'] = (MagicMock(), 0.0)
+
+        with patch('tawhiri.api.ADMIN_TOKEN', 'secret'):
+            response = self.client.post(
+                '/admin/flush', headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(_ds_cache, {})
+        self.assertEqual(_lookup_elevation.cache_info().currsize, 0)
+
+
+def _exit_worker(req, ds_time):
+    """Stand-in for _run_solve whose worker process dies."""
+    os._exit(1)
+
+
+def _fake_solve(req, ds_time):
+    """Stand-in for _run_solve, importable by the solver workers."""
+    return [[[1, 52, 0, 0]], [[2, 53, 0, 0]]], {}
+
+
+class SolverPoolTest(TestCase):
+    REQUEST = {'profile': 'standard_profile', 'format': 'json',
+               'launch_datetime': 1408489200}
+    DS_TIME = datetime(2014, 8, 19, 18)
+
+    def setUp(self):
+        patcher = patch('tawhiri.api.SOLVER_PROCESSES', 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self._shutdown_pool)
+
+    def _shutdown_pool(self):
+        if api._solver_pool is not None:
+            api._solver_pool.shutdown()
+            api._solver_pool = None
+
+    def _run_prediction(self):
+        return asyncio.run(run_prediction(dict(self.REQUEST), self.DS_TIME))
+
+    def test_solve_in_pool(self):
+        with patch('tawhiri.api._run_solve', _fake_solve):
+            response = self._run_prediction()
+        self.assertIsNotNone(api._solver_pool)
+        self.assertEqual([stage['stage'] for stage in response['prediction']],
+                         ['ascent', 'descent'])
+        self.assertEqual(response['request']['dataset'], '2014-08-19T18:00:00Z')
+
+    def test_broken_pool_replaced(self):
+        """A worker dying fails the predictions on the pool, which is then
+        replaced for later predictions."""
+        with patch('tawhiri.api._run_solve', _exit_worker):
+            with self.assertRaises(PredictionException):
+                self._run_prediction()
+        self.assertIsNone(api._solver_pool)
+
+        with patch('tawhiri.api._run_solve', _fake_solve):
+            response = self._run_prediction()
+        self.assertEqual(len(response['prediction']), 2)
+
+
+class ConfigureTest(TestCase):
+    def test_settings_from_environ(self):
+        environ = {'ELEVATION_API': 'http://elevation', 'SOLVER_PROCESSES': '0',
+                   'ADMIN_TOKEN': 'secret', 'HOME': '/root'}
+        with patch.multiple('tawhiri.api', ELEVATION_API_URL=None,
+                            SOLVER_PROCESSES=4, ADMIN_TOKEN=None):
+            api.configure(api._settings_from_environ(environ))
+            self.assertEqual(api.ELEVATION_API_URL, 'http://elevation')
+            self.assertEqual(api.SOLVER_PROCESSES, 0)
+            self.assertEqual(api.ADMIN_TOKEN, 'secret')
+            self.assertEqual(api.WIND_DATASET_DIR,
+                             api.WindDataset.DEFAULT_DIRECTORY)
+
+
+class RFC3339Test(TestCase):
+    """Our RFC3339 conversions should agree with strict_rfc3339."""
+
+    def test_timestamp_to_rfc3339(self):
+        for timestamp in (0, 1408489200, 1408489200.0, 1408489200.7,
+                          1408489260.123456, 1000000000.9999996, -1.5):
+            self.assertEqual(
+                _timestamp_to_rfc3339(timestamp),
+                strict_rfc3339.timestamp_to_rfc3339_utcoffset(timestamp))
+
+    def test_rfc3339_to_timestamp(self):
+        for datestring in ('2014-08-19T23:00:00Z',
+                           '2014-08-19T23:00:00.5Z',
+                           '2014-08-19T23:00:00.123456Z',
+                           '2014-08-19T23:00:00+05:30',
+                           '2014-08-19T23:00:00.25-01:00',
+                           '1969-12-31T23:59:59.5Z',
+                           '2014-08-19T23:00:00.1234567891Z'):
+            self.assertAlmostEqual(
+                _rfc3339_to_timestamp(datestring),
+                strict_rfc3339.rfc3339_to_timestamp(datestring), places=6)
+
+    def test_rfc3339_to_timestamp_invalid(self):
+        for datestring in ('', '2014-08-19', '2014-08-19T23:00:00',
+                           '2014-08-19 23:00:00Z', '2014-08-19T23:00Z',
+                           '2014-08-19T23:00:00+0100', '2014-02-30T00:00:00Z',
+                           '2014-08-19T23:00:00,5Z',
+                           '2014-08-19T23:00:00+05:30:00',
+                           '2014-08-19T23:00:00.Z'):
+            with self.assertRaises(ValueError):
+                _rfc3339_to_timestamp(datestring)